@@ -0,0 +1,204 @@
+"""
+Register (or update) SCM packages in Copr and/or build them,
+for a whole package list, over one HTTP session.
+
+This replaces running copr-set-scm.sh, copr add-package-scm and
+copr build-package (each a new copr CLI process) for every package.
+
+    $ python copr_bulk.py --register --build --builds-file builds $(cat new.pkgs)
+    $ python -u monitor_check.py --builds-file builds
+
+Uses the API token from ~/.config/copr, get it from https://copr.fedorainfracloud.org/api
+"""
+import aiohttp
+import asyncio
+import configparser
+import logging
+import pathlib
+import sys
+
+import click
+from click import secho
+
+COPR_CONFIG = '~/.config/copr'
+API = '{copr_url}/api_3'
+CLONE_URL = 'https://src.fedoraproject.org/rpms/{package}.git'
+PROJECT = '@python/python3.10'
+RETRIES = 5
+LOGLEVEL = logging.WARNING
+
+logger = logging.getLogger('copr_bulk')
+
+
+class CoprError(Exception):
+    pass
+
+
+def copr_config():
+    config = configparser.ConfigParser()
+    config.read(pathlib.Path(COPR_CONFIG).expanduser())
+    try:
+        section = config['copr-cli']
+        return section.get('copr_url', 'https://copr.fedorainfracloud.org'), \
+            aiohttp.BasicAuth(section['login'], section['token'])
+    except KeyError:
+        raise CoprError(f'No Copr API token in {COPR_CONFIG}, '
+                        'get it from https://copr.fedorainfracloud.org/api') from None
+
+
+async def request(session, method, url, semaphore, **kwargs):
+    """
+    Send the request to the Copr API, retrying connection errors,
+    timeouts and server errors with an exponential backoff.
+    POST is not idempotent (it would e.g. submit the build again),
+    so it is only retried when the connection could not be established.
+    Returns the status and the JSON response.
+    """
+    idempotent = method == 'GET'
+    for attempt in range(RETRIES):
+        async with semaphore:
+            logger.debug('%s %s', method, url)
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    if response.status < 500:
+                        try:
+                            json = await response.json(content_type=None)
+                        except ValueError:
+                            json = None
+                        if not isinstance(json, dict):
+                            raise CoprError(f'{method} {url}: {response.status} '
+                                            'without a JSON object in the response')
+                        return response.status, json
+                    logger.debug('%s %s: %s', method, url, response.status)
+                    if not idempotent:
+                        raise CoprError(f'{method} {url}: {response.status}')
+            except aiohttp.ClientConnectorError as e:
+                logger.debug('%s %s: %r', method, url, e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.debug('%s %s: %r', method, url, e)
+                if not idempotent:
+                    raise CoprError(f'{method} {url}: {e!r}') from None
+        await asyncio.sleep(2 ** attempt)
+    raise CoprError(f'{method} {url} failed {RETRIES} times')
+
+
+async def register(session, api, project, package, committish, semaphore):
+    """Add the SCM package to the project, or update it if it exists"""
+    ownername, _, projectname = project.partition('/')
+    status, _ = await request(session, 'GET', f'{api}/package', semaphore, params={
+        'ownername': ownername, 'projectname': projectname, 'packagename': package,
+    })
+    action = 'edit' if status == 200 else 'add'
+    status, json = await request(
+        session, 'POST', f'{api}/package/{action}/{ownername}/{projectname}/{package}/scm',
+        semaphore, json={
+            'package_name': package,
+            'clone_url': CLONE_URL.format(package=package),
+            'committish': committish,
+            'scm_type': 'git',
+            'source_build_method': 'rpkg',
+            'webhook_rebuild': True,
+        })
+    if status != 200:
+        raise CoprError(f'Cannot {action} {package}: {json.get("error", status)}')
+
+
+async def build(session, api, project, package, semaphore):
+    """Submit a build of the package, return the build id"""
+    ownername, _, projectname = project.partition('/')
+    status, json = await request(session, 'POST', f'{api}/package/build', semaphore, json={
+        'ownername': ownername,
+        'projectname': projectname,
+        'package_name': package,
+        'background': True,
+    })
+    if status != 200:
+        raise CoprError(f'Cannot build {package}: {json.get("error", status)}')
+    return json['id']
+
+
+async def process(session, api, project, package, semaphore,
+                  *, do_register, do_build, committish, builds_file):
+    try:
+        if do_register:
+            await register(session, api, project, package, committish, semaphore)
+        if do_build:
+            build_id = await build(session, api, project, package, semaphore)
+            secho(f'{package} {build_id}', fg='green')
+            if builds_file:
+                print(package, build_id, file=builds_file, flush=True)
+        else:
+            secho(f'{package} OK', fg='green')
+        return True
+    except CoprError as e:
+        secho(f'{package} fail: {e}', fg='red')
+        return False
+
+
+async def main(pkgs, project, do_register, do_build, committish, builds_file, jobs):
+    logging.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        level=LOGLEVEL)
+
+    try:
+        copr_url, auth = copr_config()
+    except CoprError as e:
+        sys.exit(str(e))
+    api = API.format(copr_url=copr_url)
+    semaphore = asyncio.Semaphore(jobs)
+
+    async with aiohttp.ClientSession(auth=auth) as session:
+        results = await asyncio.gather(*(
+            process(session, api, project, package, semaphore,
+                    do_register=do_register, do_build=do_build,
+                    committish=committish, builds_file=builds_file)
+            for package in pkgs))
+
+    failed = results.count(False)
+    if failed:
+        sys.exit(f'{failed} packages failed')
+
+
+@click.command()
+@click.argument('pkgs', nargs=-1, required=True)
+@click.option(
+    '--project',
+    default=PROJECT,
+    show_default=True,
+    help='Copr project to use'
+)
+@click.option(
+    '--register/--no-register',
+    'do_register',
+    help='Add the packages as SCM packages (or update the existing ones)'
+)
+@click.option(
+    '--build/--no-build',
+    'do_build',
+    default=True,
+    show_default=True,
+    help='Submit builds of the packages'
+)
+@click.option(
+    '--committish',
+    default='rawhide',
+    show_default=True,
+    help='Branch to build the SCM packages from'
+)
+@click.option(
+    '--builds-file',
+    type=click.File('w'),
+    help='Write "package build_id" lines to a given file (for monitor_check --builds-file)'
+)
+@click.option(
+    '--jobs',
+    default=12,
+    show_default=True,
+    help='How many requests to send in parallel'
+)
+def run(pkgs, project, do_register, do_build, committish, builds_file, jobs):
+    asyncio.run(main(pkgs, project, do_register, do_build, committish, builds_file, jobs))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,159 @@
+"""
+Collect Koji build states (and build vs. root failure reasons) for all
+packages built with fedpkg-build.sh, i.e. for all ${package}.log files.
+
+This replaces build-status.sh and build-failure-reason.sh, which needed
+several sequential http calls per package.
+"""
+import aiohttp
+import asyncio
+import json
+import logging
+import pathlib
+import re
+import sys
+
+import click
+from click import secho
+
+TASK_INFO = re.compile(r'Task info: (https://\S+taskID=(\d+))')
+TASK_STATE = re.compile(r'<td class="task([a-z]+)"')
+FAILED_SUBTASK = re.compile(r'taskID=([0-9]+)" class="taskfailed"')
+BUILDLOG = 'https://kojipkgs.fedoraproject.org//work/tasks/{bucket}/{task}/build.log'
+# build.logs shorter than this mean the build failed in mock root setup
+LIMIT = 1300
+# states that will not change anymore, such results are cached
+FINISHED = {'closed', 'failed', 'canceled'}
+CACHE = '_koji_tasks.json'
+LOGLEVEL = logging.WARNING
+
+COLORS = {
+    'closed': 'green',
+    'failed': 'red',
+    'canceled': 'magenta',
+}
+
+logger = logging.getLogger('koji_build_status')
+
+
+async def fetch(session, url, http_semaphore):
+    async with http_semaphore:
+        logger.debug('fetch %s', url)
+        try:
+            async with session.get(url) as response:
+                return await response.text('utf-8')
+        except aiohttp.client_exceptions.ServerDisconnectedError:
+            await asyncio.sleep(1)
+            return await fetch(session, url, http_semaphore)
+
+
+async def length(session, url, http_semaphore):
+    async with http_semaphore:
+        logger.debug('length %s', url)
+        async with session.head(url) as response:
+            return int(response.headers.get('content-length', 0))
+
+
+def buildlog_link(task):
+    return BUILDLOG.format(bucket=task % 10000, task=task)
+
+
+def task_from_log(path):
+    """The last Koji task submitted in the given fedpkg log (or None)"""
+    tasks = TASK_INFO.findall(path.read_text(errors='replace'))
+    if not tasks:
+        return None, None
+    url, task = tasks[-1]
+    return url, int(task)
+
+
+async def task_result(session, url, http_semaphore):
+    """
+    Resolve the task state and, for failed tasks,
+    the failed subtask and whether it failed in build or in root.
+    """
+    page = await fetch(session, url, http_semaphore)
+    hit = TASK_STATE.search(page)
+    state = hit.group(1) if hit else 'unknown'
+    result = {'state': state, 'subtask': None, 'reason': None}
+    if state != 'failed':
+        return result
+
+    hit = FAILED_SUBTASK.search(page)
+    if not hit:
+        return result
+    subtask = int(hit.group(1))
+    result['subtask'] = subtask
+    content_length = await length(session, buildlog_link(subtask), http_semaphore)
+    result['reason'] = 'build' if content_length > LIMIT else 'root'
+    return result
+
+
+async def process(session, package, url, task, cache, http_semaphore):
+    key = str(task)
+    if key not in cache:
+        result = await task_result(session, url, http_semaphore)
+        if result['state'] in FINISHED:
+            cache[key] = result
+    else:
+        result = cache[key]
+    return package, task, result
+
+
+def load_cache():
+    try:
+        with open(CACHE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_cache(cache):
+    with open(CACHE, 'w') as f:
+        json.dump(cache, f, indent=4, sort_keys=True)
+
+
+async def main(logs):
+    logging.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        level=LOGLEVEL)
+
+    http_semaphore = asyncio.Semaphore(20)
+    cache = load_cache()
+    jobs = []
+
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        for log in logs:
+            url, task = task_from_log(log)
+            if task is None:
+                secho(f'{log.stem} has no Koji task', fg='yellow', file=sys.stderr)
+                continue
+            jobs.append(process(session, log.stem, url, task, cache, http_semaphore))
+        try:
+            results = await asyncio.gather(*jobs)
+        finally:
+            save_cache(cache)
+
+    for package, task, result in sorted(results, key=lambda r: r[0]):
+        line = f'{package: <40} {task: >10} {result["state"]: <8} {result["reason"] or ""}'
+        secho(line, fg=COLORS.get(result['state']))
+
+
+@click.command()
+@click.argument(
+    'logs',
+    nargs=-1,
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+)
+def run(logs):
+    """
+    Print a table of Koji task states for the given fedpkg logs
+    (default: all *.log files in the current directory).
+    """
+    logs = logs or sorted(pathlib.Path().glob('*.log'))
+    asyncio.run(main(logs))
+
+
+if __name__ == '__main__':
+    run()
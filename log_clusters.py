@@ -0,0 +1,104 @@
+"""
+Group failed builds by the root cause visible in their build logs.
+
+The error tail of each log is normalized (paths, numbers, addresses...),
+fingerprinted with MinHash and the fingerprints are bucketed with
+locality-sensitive hashing (LSH), so similar logs end up in the same
+cluster without comparing all the pairs.
+"""
+import random
+import re
+import zlib
+from collections import defaultdict
+
+# Lines that end the interesting part of the log, the earliest one in the log is used
+TAIL_END = (
+    b'\nRPM build errors:',
+    b'\nerror: Bad exit status from',
+    b'\nCopr build error:',
+)
+TAIL_LINES = 40
+EXCERPT_LINES = 10
+SHINGLE = 3  # words
+PERMUTATIONS = 64
+BANDS = 16  # of PERMUTATIONS // BANDS rows each
+PRIME = (1 << 61) - 1
+
+NORMALIZE = (
+    (re.compile(rb'/builddir/build/(BUILD|BUILDROOT)/[^/\s]+'), rb'/\1'),
+    (re.compile(rb'/tmp/[^\s]+'), rb'/tmp'),
+    (re.compile(rb'0x[0-9a-fA-F]+'), rb'0x'),
+    (re.compile(rb'\b[0-9a-f]{7,}\b'), rb'HASH'),
+    (re.compile(rb'\d+'), rb'0'),
+)
+
+_random = random.Random(1890881)
+_PARAMS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME))
+           for _ in range(PERMUTATIONS)]
+
+
+def error_tail(content):
+    """The last TAIL_LINES lines before the earliest TAIL_END marker (or the log end)"""
+    positions = (content.find(marker) for marker in TAIL_END)
+    end = min((position for position in positions if position != -1), default=len(content))
+    return content[:end].rstrip().splitlines()[-TAIL_LINES:]
+
+
+def normalize(line):
+    for regex, replacement in NORMALIZE:
+        line = regex.sub(replacement, line)
+    return line
+
+
+def shingles(lines):
+    words = [word for line in lines for word in normalize(line).split()]
+    return {zlib.crc32(b' '.join(words[i:i + SHINGLE]))
+            for i in range(max(len(words) - SHINGLE + 1, 1))}
+
+
+def minhash(hashes):
+    return tuple(min((a * h + b) % PRIME for h in hashes) for a, b in _PARAMS)
+
+
+def fingerprint(content):
+    """
+    Return the MinHash signature and a short excerpt of the log's error tail.
+    Works on bytes, so it can be used with monitor_check.classify().
+    """
+    tail = error_tail(content)
+    excerpt = b'\n'.join(tail[-EXCERPT_LINES:]).decode('utf-8', 'replace')
+    return minhash(shingles(tail)), excerpt
+
+
+def clusters(fingerprints):
+    """
+    Group the packages of the {package: (signature, excerpt)} dict:
+    packages sharing a signature band bucket end up in the same cluster.
+    Returns a list of (packages, excerpt) sorted from the biggest cluster.
+    """
+    parents = {package: package for package in fingerprints}
+
+    def root(package):
+        while parents[package] != package:
+            parents[package] = parents[parents[package]]
+            package = parents[package]
+        return package
+
+    rows = PERMUTATIONS // BANDS
+    buckets = defaultdict(list)
+    for package, (signature, _) in fingerprints.items():
+        for band in range(BANDS):
+            buckets[band, signature[band * rows:(band + 1) * rows]].append(package)
+
+    for packages in buckets.values():
+        first, *others = packages
+        for other in others:
+            parents[root(other)] = root(first)
+
+    groups = defaultdict(list)
+    for package in sorted(fingerprints):
+        groups[root(package)].append(package)
+
+    return sorted(((packages, fingerprints[packages[0]][1])
+                   for packages in groups.values()),
+                  key=lambda cluster: (-len(cluster[0]), cluster[0]))
@@ -1,35 +1,63 @@
 import aiohttp
 import asyncio
 import bugzilla
+import functools
+import gzip
+import json
 import logging
+import multiprocessing
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta, timezone
+from json import loads as json_loads
 from urllib.parse import urlencode, quote, unquote
-from textwrap import dedent
+from textwrap import dedent, indent
+from types import SimpleNamespace
 import webbrowser
+import zlib
 
 import click
 from click import secho
-from collections import Counter
+from collections import Counter, defaultdict
 
-import dnf
 from anytree import Node, RenderTree, findall_by_attr
 
-MONITOR = 'https://copr.fedorainfracloud.org/coprs/g/python/python3.10/monitor/'
-INDEX = 'https://copr-be.cloud.fedoraproject.org/results/@python/python3.10/fedora-rawhide-x86_64/{build:08d}-{package}/'  # keep the slash
+import log_clusters
+import rawhide_deps
+
+COPR = 'https://copr.fedorainfracloud.org'
+MONITOR = COPR + '/api_3/monitor?{query}'
+PROJECT_URL = COPR + '/coprs/{path}/'
+INDEX = 'https://copr-be.cloud.fedoraproject.org/results/{project}/{chroot}/{build:08d}-{package}/'  # keep the slash
 PDC = 'https://pdc.fedoraproject.org/rest_api/v1/component-branches/?name=rawhide&global_component={package}'
-PACKAGE = re.compile(r'<a href="/coprs/g/python/python3.10/package/([^/]+)/">')
-BUILD = re.compile(r'<a href="/coprs/g/python/python3.10/build/([^/]+)/">')
-RESULT = re.compile(r'<span class="build-([^"]+)"')
-RPM_FILE = "<td class='t'>RPM File</td>"
-TAG = 'f34'
+# file links in the listing, not the parent or subdirectories or the sorting links
+LISTING_NAME = re.compile(r'<a href=["\']([^"\'/?]+)["\']')
+PROJECTS = ('@python/python3.10',)
+CHROOTS = ('fedora-rawhide-x86_64',)
+TAG = 'f34'  # for rawhide chroots, other Fedora chroots use their version
 LIMIT = 1200
+LENGTHS_CACHE = '_buildlog_lengths.json'
+HISTOGRAM_BUCKETS = 50
 BUGZILLA = 'bugzilla.redhat.com'
-TRACKER = 1890881  # PYTHON3.10
+BUGZILLA_FIELDS = ['id', 'component', 'status', 'resolution', 'blocks']
+BUGZILLA_CACHE = '_bugzillas.json'
+BUGZILLA_FULL_SYNC = timedelta(days=7)
+# Per project, used in the bug reports
+BUG_REPORTS = {
+    '@python/python3.10': {
+        'tracker': 1890881,  # PYTHON3.10
+        'python': '3.10',
+        'prerelease': '3.10.0a5',
+        'fedora': 35,
+    },
+}
 LOGLEVEL = logging.WARNING
+# how often to measure the event loop lag, in seconds
+LAG_INTERVAL = 0.1
 
-DNF_CACHEDIR = '_dnf_cache_dir'
-ARCH = 'x86_64'
+PKGS = 'python310.pkgs'
 
 EXPLANATION = {
     'red': 'probably FTBFS',
@@ -112,23 +140,78 @@ REASONS = {
     },
 }
 
+# The logs are matched as bytes, see _classify()
+REASON_SIGNATURES = {name: re.compile(reason["regex"].encode())
+                     for name, reason in REASONS.items()}
+MISSING_DEPENDENCY = re.compile(rb"Problem: package (.*?) requires")
+
 logger = logging.getLogger('monitor_check')
 
 
-def _bugzillas():
+def load_bugzillas(trackers):
+    try:
+        with open(BUGZILLA_CACHE) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        cache = None
+    if (
+        not cache
+        or cache['trackers'] != trackers
+        or datetime.now(timezone.utc) - datetime.fromisoformat(cache['full_sync']) > BUGZILLA_FULL_SYNC
+    ):
+        # bugs that stopped blocking the trackers are only dropped by a full sync
+        return {'trackers': trackers, 'full_sync': None, 'last_sync': None, 'bugs': {}}
+    return cache
+
+
+def _bugzillas(trackers):
+    """
+    Bugs blocking the trackers, synced to BUGZILLA_CACHE.
+    Only bugs changed since the last sync are downloaded, with only the fields we use.
+    """
+    cache = load_bugzillas(trackers)
     bzapi = bugzilla.Bugzilla(BUGZILLA)
-    query = bzapi.build_query(product='Fedora')
-    query['blocks'] = TRACKER
-    return [b for b in sorted(bzapi.query(query), key=lambda b: -b.id)
+    query = bzapi.build_query(product='Fedora', include_fields=BUGZILLA_FIELDS)
+    query['blocks'] = trackers
+    if cache['last_sync']:
+        query['last_change_time'] = cache['last_sync']
+
+    # with some overlap, not to miss changes made while we query
+    now = datetime.now(timezone.utc)
+    next_sync = (now - timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    for b in bzapi.query(query):
+        cache['bugs'][str(b.id)] = {field: getattr(b, field) for field in BUGZILLA_FIELDS}
+    cache['last_sync'] = next_sync
+    cache['full_sync'] = cache['full_sync'] or now.isoformat()
+
+    with open(BUGZILLA_CACHE, 'w') as f:
+        json.dump(cache, f, indent=4, sort_keys=True)
+
+    bugs = (SimpleNamespace(**fields) for fields in cache['bugs'].values())
+    return [b for b in sorted(bugs, key=lambda b: -b.id)
             if b.resolution != 'DUPLICATE']
 
 
-async def bugzillas():
+async def bugzillas(trackers):
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _bugzillas)
+    return await loop.run_in_executor(None, _bugzillas, sorted(trackers))
 
 
-async def fetch(session, url, http_semaphore, *, json=False):
+def decompress(body):
+    """
+    The session does not decompress responses (see main()),
+    so the logs can be decompressed in the process pool.
+    """
+    if body[:2] == b'\x1f\x8b':
+        return gzip.decompress(body)
+    return body
+
+
+async def fetch(session, url, http_semaphore, *, json=False, raw=False):
+    """
+    Get the content of the url as text (or parsed JSON).
+    With raw=True, get the undecoded (and possibly gzipped) bytes.
+    """
     async with http_semaphore:
         logger.debug('fetch %s', url)
         try:
@@ -137,85 +220,268 @@ async def fetch(session, url, http_semaphore, *, json=False):
                 # https://pagure.io/copr/copr/issue/1648
                 if response.status == 404 and url.endswith('.gz'):
                     url = url[:-3]
-                    return await fetch(session, url, http_semaphore, json=json)
+                    return await fetch(session, url, http_semaphore, json=json, raw=raw)
+                body = await response.read()
+                if raw:
+                    return body
                 if json:
-                    return await response.json()
-                return await response.text('utf-8')
+                    return json_loads(decompress(body))
+                return decompress(body).decode('utf-8')
         except aiohttp.client_exceptions.ServerDisconnectedError:
             await asyncio.sleep(1)
-            return await fetch(session, url, http_semaphore, json=json)
+            return await fetch(session, url, http_semaphore, json=json, raw=raw)
+
+
+async def fetch_if_modified(session, url, http_semaphore, validators):
+    """
+    Like fetch(json=True), but a conditional GET:
+    Sends the ETag/Last-Modified validators of the previous response for the url
+    (stored in the validators dict) and returns None if it was not modified.
+    """
+    etag, modified = validators.get(url, (None, None))
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+    async with http_semaphore:
+        logger.debug('fetch_if_modified %s', url)
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    return None
+                validators[url] = (response.headers.get('ETag'),
+                                   response.headers.get('Last-Modified'))
+                return json_loads(decompress(await response.read()))
+        except aiohttp.client_exceptions.ServerDisconnectedError:
+            await asyncio.sleep(1)
+            return await fetch_if_modified(session, url, http_semaphore, validators)
+
+
+class ResultsIndex:
+    """The files of a build results directory, parsed from its listing"""
+
+    def __init__(self, url, listing=''):
+        self.url = url
+        self.files = {unquote(name) for name in LISTING_NAME.findall(listing)}
+
+    @property
+    def rpms(self):
+        return [name for name in self.files
+                if name.endswith('.rpm') and not name.endswith('.src.rpm')]
+
+    def resolve(self, name):
+        """
+        The real name of the file in the directory:
+        copr sometimes does not rename the logs, see fetch()
+        """
+        if name not in self.files and name.endswith('.gz') and name[:-3] in self.files:
+            return name[:-3]
+        return name
+
+
+# Shared by all checks, values are futures
+_results_indexes = {}
+
+
+async def results_index(session, url, http_semaphore):
+    """The ResultsIndex of the directory url, fetched once per build"""
+    if url not in _results_indexes:
+        _results_indexes[url] = asyncio.ensure_future(
+            _results_index(session, url, http_semaphore))
+    return await asyncio.shield(_results_indexes[url])
+
+
+async def _results_index(session, url, http_semaphore):
+    try:
+        return ResultsIndex(url, await fetch(session, url, http_semaphore))
+    except (aiohttp.ClientError, UnicodeDecodeError, OSError, EOFError, zlib.error):
+        logger.debug('broken index %s', url)
+        return ResultsIndex(url)
+
+
+def resolve(url):
+    """
+    Resolve the file url with the results directory index, returns the real url.
+    Only if the index was already fetched (by failed_but_built()), it would be
+    one more request otherwise: fetch() and length() fall back on 404 instead.
+    """
+    directory, _, name = url.rpartition('/')
+    index = _results_indexes.get(directory + '/')
+    if index is None or not index.done() or index.cancelled() or index.exception():
+        return url
+    index = index.result()
+    return index.url + index.resolve(name)
 
 
 async def length(session, url, http_semaphore):
+    url = resolve(url)
     async with http_semaphore:
         logger.debug('length %s', url)
         async with session.head(url) as response:
-            return int(response.headers.get('content-length'))
+            # see fetch()
+            if response.status == 404 and url.endswith('.gz'):
+                url = url[:-3]
+            else:
+                return int(response.headers.get('content-length'))
+    return await length(session, url, http_semaphore)
 
 
-async def is_cmake(session, url, http_semaphore):
+def load_lengths():
     try:
-        content = await fetch(session, url, http_semaphore)
-    except aiohttp.client_exceptions.ClientPayloadError:
-        logger.debug('broken content %s', url)
-        return False
-    make = 'No targets specified and no makefile found.' in content
-    cmake = '/usr/bin/cmake' in content
-    return make and cmake
+        with open(LENGTHS_CACHE) as f:
+            # older caches were keyed by build ids only, drop those
+            return {url: length for url, length in json.load(f).items() if '/' in url}
+    except FileNotFoundError:
+        return {}
 
 
-async def is_blue(session, url, http_semaphore):
-    try:
-        content = await fetch(session, url, http_semaphore)
-    except aiohttp.client_exceptions.ClientPayloadError:
-        logger.debug('broken content %s', url)
-        return False
-    return 'but none of the providers can be installed' in content
+def save_lengths(lengths):
+    with open(LENGTHS_CACHE, 'w') as f:
+        json.dump(lengths, f, indent=4, sort_keys=True)
 
 
-async def is_repo_404(session, url, http_semaphore):
-    try:
-        content = await fetch(session, url, http_semaphore)
-    except aiohttp.client_exceptions.ClientPayloadError:
-        logger.debug('broken content %s', url)
-        return False
-    return content.count('Failed to download metadata for repo') >= 3
+async def buildlog_length(session, target, package, build, lengths, http_semaphore):
+    # keyed by the URL, the build ids are shared by all chroots of the build
+    url = buildlog_link(target, package, build)
+    if url not in lengths:
+        lengths[url] = await length(session, url, http_semaphore)
+    return lengths[url]
+
 
+def print_histogram(build_lengths, bucket_size):
+    """
+    Print a histogram of build.log lengths, to see where LIMIT should be.
+    Everything longer than HISTOGRAM_BUCKETS buckets goes to the last one.
+    """
+    buckets = Counter(min(l // bucket_size, HISTOGRAM_BUCKETS)
+                      for l in build_lengths)
+    width = max(buckets.values(), default=0)
+    for bucket in range(HISTOGRAM_BUCKETS + 1):
+        count = buckets[bucket]
+        start = bucket * bucket_size
+        if bucket == HISTOGRAM_BUCKETS:
+            label = f'{start: >6}+'
+        else:
+            label = f'{start: >6}-{start + bucket_size - 1: <6}'
+        bar = '#' * (count * 60 // width) if width else ''
+        fg = 'red' if start <= LIMIT < start + bucket_size else None
+        secho(f'{label: <14} {count: >6} {bar}', fg=fg)
 
-async def is_timeout(session, url, http_semaphore):
+
+async def buildlog_lengths(session, builds, http_semaphore, bucket_size):
+    """
+    HEAD the build.logs of all finished latest builds and show the histogram.
+    The lengths are cached per build.log URL in LENGTHS_CACHE.
+    """
+    lengths = load_lengths()
     try:
-        content = await fetch(session, url, http_semaphore)
-    except aiohttp.client_exceptions.ClientPayloadError:
-        logger.debug('broken content %s', url)
-        return False
-    return 'Copr timeout => sending INT' in content
+        build_lengths = await gather_or_cancel(*(
+            buildlog_length(session, target, package, build, lengths, http_semaphore)
+            for target, package, build, status in builds
+            if status in ('succeeded', 'failed')
+        ))
+    finally:
+        save_lengths(lengths)
+    print_histogram(build_lengths, bucket_size)
 
 
-async def guess_reason(session, url, http_semaphore):
+async def classify(session, url, check, http_semaphore, *, default=False):
+    """
+    Fetch the log at url and return check(content).
+    The decompression and the check run in the process pool,
+    so the event loop keeps serving other responses meanwhile.
+    """
+    url = resolve(url)
     try:
-        content = await fetch(session, url, http_semaphore)
+        body = await fetch(session, url, http_semaphore, raw=True)
     except aiohttp.client_exceptions.ClientPayloadError:
         logger.debug('broken content %s', url)
-        return False
-    for reason in REASONS.values():
-        match = re.search(reason["regex"], content)
+        return default
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(PROCESS_POOL, _classify, body, check)
+    except (OSError, EOFError, zlib.error):
+        # truncated or otherwise broken gzip
+        logger.debug('broken content %s', url)
+        return default
+
+
+def _classify(body, check):
+    # The checks work on bytes, only the matched excerpts are decoded
+    return check(decompress(body))
+
+
+def excerpt(match, group=0):
+    return match.group(group).decode('utf-8', 'replace')
+
+
+def _is_cmake(content):
+    make = b'No targets specified and no makefile found.' in content
+    cmake = b'/usr/bin/cmake' in content
+    return make and cmake
+
+
+def _is_blue(content):
+    return b'but none of the providers can be installed' in content
+
+
+def _is_repo_404(content):
+    return content.count(b'Failed to download metadata for repo') >= 3
+
+
+def _is_timeout(content):
+    return b'Copr timeout => sending INT' in content
+
+
+def _guess_reason(content):
+    for name, reason in REASONS.items():
+        match = REASON_SIGNATURES[name].search(content)
         if match:
             return {
-                "long_description": reason["long_description"].format(MATCH=match.group()),
-                "short_description": reason.get("short_description") or match.group(),
+                "long_description": reason["long_description"].format(MATCH=excerpt(match)),
+                "short_description": reason.get("short_description") or excerpt(match),
             }
     return None
 
-async def guess_missing_dependency(session, package, build, http_semaphore):
-    url = builderlive_link(package, build)
-    try:
-        content = await fetch(session, url, http_semaphore)
-    except aiohttp.client_exceptions.ClientPayloadError:
-        logger.debug('broken content %s', url)
+
+def _inspect_red(content, fingerprint=False):
+    """
+    All the checks of a red package's builder-live.log, not to fetch it repeatedly:
+    returns (is timeout, guessed reason, log_clusters.fingerprint() or None)
+    """
+    return (_is_timeout(content), _guess_reason(content),
+            log_clusters.fingerprint(content) if fingerprint else None)
+
+
+def _missing_dependency(content):
+    match = MISSING_DEPENDENCY.search(content)
+    return excerpt(match, 1) if match else ''
+
+
+async def is_cmake(session, url, http_semaphore):
+    return await classify(session, url, _is_cmake, http_semaphore)
+
+
+async def is_blue(session, url, http_semaphore):
+    return await classify(session, url, _is_blue, http_semaphore)
+
+
+async def is_repo_404(session, url, http_semaphore):
+    return await classify(session, url, _is_repo_404, http_semaphore)
+
+
+async def inspect_red(session, url, http_semaphore, *, fingerprint=False):
+    return await classify(session, url, functools.partial(_inspect_red, fingerprint=fingerprint),
+                          http_semaphore, default=(False, None, None))
+
+async def guess_missing_dependency(session, target, package, build, http_semaphore):
+    url = builderlive_link(target, package, build)
+    nevra = await classify(session, url, _missing_dependency, http_semaphore, default=None)
+    if nevra is None:
         return False
-    match = re.search(r"Problem: package (.*?) requires", content)
-    if match:
-        pkg = source_name(match.group(1))
+    if nevra:
+        pkg = source_name(nevra)
         if pkg not in missing_dependencies:
             missing_dependencies[pkg] = []
             missing_dependencies[pkg].append(package)
@@ -225,6 +491,15 @@ async def guess_missing_dependency(session, package, build, http_semaphore):
     else:
         missing_dependencies['match_failed'].append(package)
 
+def print_clusters(fingerprints):
+    p()
+    p('Red packages grouped by similar build log errors:')
+    for packages, excerpt in log_clusters.clusters(fingerprints):
+        p()
+        p(f'{len(packages)}: {" ".join(packages)}', bold=True)
+        p(indent(excerpt, '    '))
+
+
 def print_dependency_tree():
     root = Node("/")
 
@@ -255,52 +530,97 @@ def print_dependency_tree():
     for pkg, count in most_common:
         print(pkg + ": " + str(count), file=sys.stderr)
 
-async def failed_but_built(session, url, http_semaphore):
+async def failed_but_built(session, url, http_semaphore, open_failed_but_built=None):
     """
     Sometimes, the package actually built, but is only marked as failed:
     https://pagure.io/copr/copr/issue/1209
 
     The build.log would be long, so we would attempt to open bugzillas.
-    Here we get the index page of the results directory and we determine that:
+    Here we get the index of the results directory and we determine that:
 
      - failed builds only have 1 SRPM
      - succeeded builds have 1 SRPM and at least 1 built RPM
     """
-    async with http_semaphore:
-        logger.debug('failed_but_built %s', url)
-        async with session.get(url) as response:
-            text = await response.text()
-            rpm_count = text.count(RPM_FILE)
-            if rpm_count > 1:
-                with open('failed_but_built.lst', 'a') as f:
-                    print(url, file=f)
-                return True
-            return False
+    index = await results_index(session, url, http_semaphore)
+    if index.rpms:
+        if open_failed_but_built:
+            print(url, file=open_failed_but_built(), flush=True)
+        return True
+    return False
+
+
+class Target:
+    """A chroot in a Copr project, e.g. @python/python3.10 fedora-rawhide-x86_64"""
+
+    def __init__(self, project, chroot):
+        self.project = project
+        self.chroot = chroot
+        self.owner, _, self.name = project.partition('/')
+        try:
+            self.bug_report = BUG_REPORTS[project]
+        except KeyError:
+            raise ValueError(f'Unknown Bugzilla tracker for {project}, add it to BUG_REPORTS') from None
+        self.tracker = self.bug_report['tracker']
+        distro, _, rest = chroot.partition('-')
+        release = rest.split('-')[0]
+        if distro != 'fedora' or not (release == 'rawhide' or release.isdigit()):
+            raise ValueError(f'Unknown Koji tag for {chroot}, only Fedora chroots are supported')
+        self.release = release
+        self.tag = TAG if release == 'rawhide' else f'f{release}'
+
+    def __str__(self):
+        return f'{self.project} {self.chroot}'
+
+    @property
+    def monitor(self):
+        return MONITOR.format(query=urlencode({'ownername': self.owner,
+                                               'projectname': self.name}))
+
+    @property
+    def url(self):
+        if self.owner.startswith('@'):
+            path = f'g/{self.owner[1:]}/{self.name}'
+        else:
+            path = self.project
+        return PROJECT_URL.format(path=path)
 
 
-def index_link(package, build):
-    return INDEX.format(package=package, build=build)
+def index_link(target, package, build):
+    return INDEX.format(project=target.project, chroot=target.chroot,
+                        package=package, build=build)
 
 
-def buildlog_link(package, build):
-    return index_link(package, build) + 'build.log.gz'
+def buildlog_link(target, package, build):
+    return index_link(target, package, build) + 'build.log.gz'
 
 
-def rootlog_link(package, build):
-    return index_link(package, build) + 'root.log.gz'
+def rootlog_link(target, package, build):
+    return index_link(target, package, build) + 'root.log.gz'
 
 
-def builderlive_link(package, build):
-    return index_link(package, build) + 'builder-live.log.gz'
+def builderlive_link(target, package, build):
+    return index_link(target, package, build) + 'builder-live.log.gz'
 
 
 class KojiError (Exception):
     pass
 
 
-async def is_retired(package, command_semaphore):
+# Shared by all targets, values are futures
+_retired = {}
+_critpath = {}
+
+
+async def is_retired(package, tag, command_semaphore):
+    if (package, tag) not in _retired:
+        _retired[package, tag] = asyncio.ensure_future(
+            _is_retired(package, tag, command_semaphore))
+    return await asyncio.shield(_retired[package, tag])
+
+
+async def _is_retired(package, tag, command_semaphore):
     cmd = ('koji', 'list-pkgs', '--show-blocked',
-           '--tag', TAG, '--package', package)
+           '--tag', tag, '--package', package)
     async with command_semaphore:
         try:
             proc = await asyncio.create_subprocess_exec(*cmd,
@@ -312,6 +632,13 @@ async def is_retired(package, command_semaphore):
 
 
 async def is_critpath(session, package, http_semaphore):
+    if package not in _critpath:
+        _critpath[package] = asyncio.ensure_future(
+            _is_critpath(session, package, http_semaphore))
+    return await asyncio.shield(_critpath[package])
+
+
+async def _is_critpath(session, package, http_semaphore):
     try:
         json = await fetch(session, PDC.format(package=quote(package)), http_semaphore, json=True)
         for result in json['results']:
@@ -324,14 +651,15 @@ async def is_critpath(session, package, http_semaphore):
         return False
 
 
-def bug(bugs, package):
+def bug(bugs, package, tracker):
     for b in bugs:
-        if b.component == package:
+        if b.component == package and tracker in b.blocks:
             return b
     return None
 
 
-counter = Counter()
+# {target: Counter of colors}
+counter = defaultdict(Counter)
 
 def pkgname(nevra):
     return nevra.rsplit("-", 2)[0]
@@ -341,65 +669,65 @@ def source_name(nevra):
     for pkg in pkgs:  # a only gets evaluated here
     #    if pkg.reponame == "fedorarawhide":
         return pkg.source_name
-    raise RuntimeError(f"Cannot find source for {name}. Hint: Remove the cache in {DNF_CACHEDIR}")
-
-def rawhide_sack():
-    """A DNF sack for rawhide, used for queries, cached"""
-    base = dnf.Base()
-    conf = base.conf
-    conf.cachedir = DNF_CACHEDIR
-    conf.substitutions['basearch'] = ARCH
-    base.repos.add_new_repo('rawhide', conf,
-        baseurl=['http://kojipkgs.fedoraproject.org/repos/rawhide/latest/$basearch/'],
-        skip_if_unavailable=False,
-        enabled=True)
-    base.fill_sack(load_system_repo=False, load_available_repos=True)
-    return base.sack
-
-RAWHIDE_SACK = rawhide_sack()
+    raise RuntimeError(f"Cannot find source for {nevra}. Hint: Remove the cache in {rawhide_deps.DNF_CACHEDIR}")
 
 def repoquery(name):
-    return RAWHIDE_SACK.query().filter(name=name, latest=1).run()
+    return rawhide_deps.rawhide_sack().query().filter(name=name, arch__neq='src', latest=1).run()
+
 
-def p(*args, **kwargs):
+def p(*args, target=None, **kwargs):
     if 'fg' in kwargs:
-        counter[kwargs['fg']] += 1
+        counter[target][kwargs['fg']] += 1
     secho(*args, **kwargs)
 
 
 async def process(
-    session, bugs, package, build, status, http_semaphore, command_semaphore,
-    *, browser_lock=None, with_reason=None, blues_file=None, magentas_file=None
+    session, bugs, target, package, build, status, http_semaphore, command_semaphore,
+    *, browser_lock=None, with_reason=None, blues_file=None, magentas_file=None,
+    label='', fingerprints=None, open_failed_but_built=None,
+    impact=None, output=None, bug_queue=None, reported=None
 ):
+    """
+    With impact ({package: number of packages it blocks}), the lines are added
+    to the output list and the bugs to open to the bug_queue list instead,
+    to be sorted by the impact.
+    """
     if status != 'failed':
         return
 
-    retired = await is_retired(package, command_semaphore)
+    def report(message, fg):
+        if impact is None:
+            p(message, fg=fg, target=target)
+        else:
+            output.append((impact.get(package, 0), message, fg, target))
+
+    retired = await is_retired(package, target.tag, command_semaphore)
 
     if retired:
-        p(f'{package} is retired', fg='green')
+        report(f'{label}{package} is retired', 'green')
         return
 
     content_length, critpath = await gather_or_cancel(
-        length(session, buildlog_link(package, build), http_semaphore),
+        length(session, buildlog_link(target, package, build), http_semaphore),
         is_critpath(session, package, http_semaphore),
     )
 
-    message = f'{package} failed len={content_length}'
+    message = f'{label}{package} failed len={content_length}'
 
     longlog = content_length > LIMIT
 
-    if longlog and await is_blue(session, rootlog_link(package, build), http_semaphore):
+    if longlog and await is_blue(session, rootlog_link(target, package, build), http_semaphore):
         longlog = False
 
     repo_404 = False
-    if await is_repo_404(session, rootlog_link(package, build), http_semaphore):
+    if await is_repo_404(session, rootlog_link(target, package, build), http_semaphore):
         longlog = True
         repo_404 = True
 
     if blues_file and not longlog:
+        await guess_missing_dependency(session, target, package, build, http_semaphore)
+        # after the guess, not to list the package again when its check is retried
         print(package, file=blues_file)
-        await guess_missing_dependency(session, package, build, http_semaphore)
 
     bz = None
     if package in EXCLUDE:
@@ -411,7 +739,7 @@ async def process(
         if magentas_file:
             print(package, file=magentas_file)
     else:
-        bz = bug(bugs, package)
+        bz = bug(bugs, package, target.tracker)
         if bz:
             message += f' bz{bz.id} {bz.status}'
             fg = 'yellow'
@@ -419,14 +747,22 @@ async def process(
         if not bz or bz.status == "CLOSED":
             fg = 'red' if longlog else 'blue'
 
+    reason = None
     if fg == 'red':
-        if await is_timeout(session, builderlive_link(package, build), http_semaphore):
+        timeout, reason, fingerprint = await inspect_red(
+            session, builderlive_link(target, package, build), http_semaphore,
+            fingerprint=fingerprints is not None)
+        if timeout:
             message += ' (copr timeout)'
             fg = 'magenta'
+        elif fingerprint:
+            fingerprints[f'{label}{package}'] = fingerprint
 
     if critpath:
         message += ' \N{FIRE}'
-    p(message, fg=fg)
+    if impact is not None:
+        message += f' (blocks {impact.get(package, 0)})'
+    report(message, fg)
 
     if (
         browser_lock
@@ -435,39 +771,48 @@ async def process(
         and (str(package) not in EXCLUDE)
         and (fg != 'magenta')
     ):
-        if not await failed_but_built(session, index_link(package, build), http_semaphore):
-            reason = await guess_reason(session, builderlive_link(package, build), http_semaphore)
+        if not await failed_but_built(session, index_link(target, package, build), http_semaphore,
+                                      open_failed_but_built):
             if with_reason and not reason:
                 return
-            await open_bz(package, build, status, browser_lock, reason)
-
-
-async def open_bz(package, build, status, browser_lock, reason=None):
+            if reported is not None:
+                # the package may be red in several chroots of the project
+                if (package, target.tracker) in reported:
+                    return
+                reported.add((package, target.tracker))
+            if bug_queue is None:
+                await open_bz(target, package, build, status, browser_lock, reason)
+            else:
+                bug_queue.append((impact.get(package, 0), target, package, build, status, reason))
+
+
+async def open_bz(target, package, build, status, browser_lock, reason=None):
     if reason == None:
         # General message for packages opened with --without-reason
         reason = {
             "long_description": "This report is automated and not very verbose, but we'll try to get back here with details.",
             "short_description": "",
         }
-    summary = f"{package} fails to build with Python 3.10: {reason['short_description']}"
+    python = target.bug_report['python']
+    summary = f"{package} fails to build with Python {python}: {reason['short_description']}"
 
     description = dedent(f"""
-        {package} fails to build with Python 3.10.0a5.
+        {package} fails to build with Python {target.bug_report['prerelease']}.
 
         {reason['long_description']}
 
         For the build logs, see:
-        https://copr-be.cloud.fedoraproject.org/results/@python/python3.10/fedora-rawhide-x86_64/{build:08}-{package}/
+        {index_link(target, package, build)}
 
-        For all our attempts to build {package} with Python 3.10, see:
-        https://copr.fedorainfracloud.org/coprs/g/python/python3.10/package/{package}/
+        For all our attempts to build {package} with Python {python}, see:
+        {target.url}package/{package}/
 
-        Testing and mass rebuild of packages is happening in copr. You can follow these instructions to test locally in mock if your package builds with Python 3.10:
-        https://copr.fedorainfracloud.org/coprs/g/python/python3.10/
+        Testing and mass rebuild of packages is happening in copr. You can follow these instructions to test locally in mock if your package builds with Python {python}:
+        {target.url}
 
         Let us know here if you have any questions.
 
-        Python 3.10 will be included in Fedora 35. To make that update smoother, we're building Fedora packages with early pre-releases of Python 3.10.
+        Python {python} will be included in Fedora {target.bug_report['fedora']}. To make that update smoother, we're building Fedora packages with early pre-releases of Python {python}.
         A build failure prevents us from testing all dependent packages (transitive [Build]Requires), so if this package is required a lot, it's important for us to get it fixed soon.
         We'd appreciate help from the people who know this package best, but if you don't want to work on this now, let us know so we can try to work around it on our side.
     """)
@@ -477,9 +822,9 @@ async def open_bz(package, build, status, browser_lock, reason=None):
         'short_desc': summary,
         'comment': description,
         'component': str(package),
-        'blocked': TRACKER,
+        'blocked': target.tracker,
         'product': 'Fedora',
-        'version': 'rawhide',
+        'version': target.release,
         #'bug_severity': 'high',
         'cc': 'mhroncok@redhat.com,thrnciar@redhat.com'
     }
@@ -507,7 +852,37 @@ missing_dependencies = {
     'match_failed': []
 }
 
-async def main(pkgs=None, open_bug_reports=False, with_reason=False, blues_file=None, magentas_file=None, dependency_tree=None):
+# Set in main(), used to parse the logs
+PROCESS_POOL = None
+
+# Event loop lags (in seconds), see measure_loop_lag()
+loop_lags = []
+
+
+async def measure_loop_lag():
+    '''
+    Record how much later than planned the event loop wakes us up,
+    i.e. for how long it was blocked by something else.
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        loop_lags.append(loop.time() - start - LAG_INTERVAL)
+
+
+def parse_monitor(monitor, target):
+    """
+    Yield (package, build, status) triples of the target's chroot
+    from the project monitor
+    """
+    for package in monitor['packages']:
+        chroot = package['chroots'].get(target.chroot)
+        if chroot:
+            yield package['name'], chroot['build_id'], chroot['state']
+
+
+async def main(pkgs=None, open_bug_reports=False, with_reason=False, blues_file=None, magentas_file=None, dependency_tree=None, lengths_histogram=None, projects=PROJECTS, chroots=CHROOTS, watch=None, clusters=False, builds_file=None, by_impact=False):
     logging.basicConfig(
         format='%(asctime)s %(name)s %(levelname)s: %(message)s',
         level=LOGLEVEL)
@@ -520,59 +895,193 @@ async def main(pkgs=None, open_bug_reports=False, with_reason=False, blues_file=
         browser_lock = asyncio.Lock()
     else:
         browser_lock = None
+    # {(package, tracker)} with a bug report opened, only one for all the chroots
+    reported = set()
 
-    async with aiohttp.ClientSession() as session:
-        # we could stream the content, but meh, get it all, it's not that long
-        monitor = fetch(session, MONITOR, http_semaphore)
-        bugs = bugzillas()
-        monitor, bugs = await asyncio.gather(monitor, bugs)
-
-        package = build = status = None
-        lasthit = 'status'
-        jobs = []
-
-        for line in monitor.splitlines():
-            hit = PACKAGE.search(line)
-            if hit:
-                assert lasthit == 'status'
-                lasthit = 'package'
-                package = unquote(hit.group(1))
-
-            hit = BUILD.search(line)
-            if hit:
-                assert lasthit == 'package'
-                lasthit = 'build'
-                build = int(hit.group(1))
-
-            hit = RESULT.search(line)
-            if hit:
-                assert lasthit == 'build'
-                lasthit = 'status'
-                status = hit.group(1)
-                if pkgs and package not in pkgs:
+    try:
+        targets = [Target(project, chroot) for project in projects for chroot in chroots]
+    except ValueError as e:
+        sys.exit(str(e))
+
+    trackers = {target.tracker for target in targets}
+    label = len(targets) > 1
+
+    impact = None
+    if by_impact:
+        with open(PKGS) as f:
+            impact = rawhide_deps.impact_index(f.read().split())
+
+    # {package: build} from copr_bulk.py, only check those
+    submitted = None
+    if builds_file:
+        submitted = {}
+        for line in builds_file:
+            package, build = line.split()
+            submitted[package] = int(build)
+
+    global PROCESS_POOL
+    # Responses are decompressed by us, so the logs can be decompressed
+    # in the process pool (see decompress() and classify()).
+    # The workers are started by a fork server, not forked from this process:
+    # by now it can run threads (Bugzilla, the DNF sack) and holding their locks
+    # in a forked child could deadlock it. The checks are top-level functions,
+    # so they are found by importing this module in the workers.
+    async with aiohttp.ClientSession(auto_decompress=False,
+                                     headers={'Accept-Encoding': 'gzip'}) as session, \
+               AsyncExitStack() as stack:
+        PROCESS_POOL = stack.enter_context(
+            ProcessPoolExecutor(mp_context=multiprocessing.get_context('forkserver')))
+        lag = asyncio.ensure_future(measure_loop_lag())
+        stack.callback(lag.cancel)
+
+        @functools.lru_cache(maxsize=None)
+        def open_failed_but_built():
+            # on the first hit, not to create the file in every run
+            return stack.enter_context(open('failed_but_built.lst', 'a'))
+
+        # not needed for the histogram
+        bugs = None if lengths_histogram else asyncio.ensure_future(bugzillas(trackers))
+        validators = {}
+        # {(target, package): (build, status)} from the previous polls
+        seen = {}
+        # the same for the builds that failed to be checked, retried in the next poll
+        retry = {}
+
+        while True:
+            # Koji, PDC and the listings change between polls
+            for cache in _retired, _critpath, _results_indexes:
+                cache.clear()
+
+            try:
+                # one monitor per project, shared by all its chroots
+                monitors = await asyncio.gather(*(
+                    fetch_if_modified(session, Target(project, chroots[0]).monitor,
+                                      http_semaphore, validators)
+                    for project in projects))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if not watch:
+                    raise
+                logger.exception('Cannot fetch the monitors, retrying in %s seconds', watch)
+                await asyncio.sleep(watch)
+                continue
+            monitors = dict(zip(projects, monitors))
+
+            todo = dict(retry)
+            for target in targets:
+                if monitors[target.project] is None:
+                    logger.debug('not modified %s', target.project)
                     continue
-                jobs.append(asyncio.ensure_future(process(
-                    session, bugs, package, build, status,
-                    http_semaphore, command_semaphore,
-                    browser_lock=browser_lock, with_reason=with_reason,
-                    blues_file=blues_file, magentas_file=magentas_file
-                )))
-
-            if 'Possible build states:' in line:
-                break
-
-        try:
-            await gather_or_cancel(*jobs)
-        except KojiError as e:
-            sys.exit(str(e))
+                for package, build, status in parse_monitor(monitors[target.project], target):
+                    if pkgs and package not in pkgs:
+                        continue
+                    if submitted is not None and submitted.get(package) != build:
+                        continue
+                    if seen.get((target, package)) != (build, status):
+                        todo[target, package] = build, status
+            builds = [(target, package, build, status)
+                      for (target, package), (build, status) in todo.items()]
+
+            if lengths_histogram:
+                await buildlog_lengths(session, builds, http_semaphore, lengths_histogram)
+                return
 
+            if builds:
+                if bugs is None:
+                    bugs = asyncio.ensure_future(bugzillas(trackers))
+                try:
+                    bugs = await bugs
+                except Exception:
+                    if not watch:
+                        raise
+                    logger.exception('Cannot fetch the bugs, retrying in %s seconds', watch)
+                    bugs = None
+                    # the monitors may not change, check these next time
+                    retry = todo
+                    await asyncio.sleep(watch)
+                    continue
+                fingerprints = {} if clusters else None
+                failed = await check(session, bugs, builds, targets, http_semaphore, command_semaphore,
+                                     browser_lock=browser_lock, reported=reported,
+                                     with_reason=with_reason,
+                                     blues_file=blues_file, magentas_file=magentas_file,
+                                     label=label, fingerprints=fingerprints, impact=impact,
+                                     open_failed_but_built=open_failed_but_built)
+
+                if dependency_tree:
+                    print_dependency_tree()
+
+                if fingerprints:
+                    print_clusters(fingerprints)
+
+                # refresh the bugs with the next changes
+                bugs = None
+                counter.clear()
+
+                retry = {(target, package): (build, status)
+                         for target, package, build, status in failed}
+                for key, value in todo.items():
+                    if key not in retry:
+                        seen[key] = value
+
+                if failed and not watch:
+                    sys.exit(f'Failed to check {len(failed)} builds, see the errors above')
+                if failed:
+                    logger.warning('Failed to check %d builds, retrying them in %s seconds',
+                                   len(failed), watch)
+
+            if not watch:
+                break
+            await asyncio.sleep(watch)
+
+
+async def check(session, bugs, builds, targets, http_semaphore, command_semaphore,
+                *, label=False, impact=None, browser_lock=None, **kwargs):
+    # with impact, process() collects these to be sorted, the most blocking first
+    output = [] if impact is not None else None
+    bug_queue = [] if impact is not None else None
+
+    jobs = []
+    for target, package, build, status in builds:
+        jobs.append(asyncio.ensure_future(process(
+            session, bugs, target, package, build, status,
+            http_semaphore, command_semaphore,
+            label=f'[{target}] ' if label else '', browser_lock=browser_lock,
+            impact=impact, output=output, bug_queue=bug_queue, **kwargs
+        )))
+
+    # a failing check does not stop the others, the failed builds are returned
+    failed = []
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    for (target, package, build, status), result in zip(builds, results):
+        if isinstance(result, Exception):
+            logger.error('%sCannot check %s (build %s)', f'[{target}] ' if label else '',
+                         package, build, exc_info=result)
+            failed.append((target, package, build, status))
+
+    if impact is not None:
+        for _, message, fg, target in sorted(output, key=lambda line: (-line[0], line[1])):
+            p(message, fg=fg, target=target)
+        for _, target, package, build, status, reason in sorted(
+            bug_queue, key=lambda bug: (-bug[0], bug[2])
+        ):
+            await open_bz(target, package, build, status, browser_lock, reason)
+
+    for target in targets:
         p(file=sys.stderr)
-        for fg, count in counter.most_common():
+        if label:
+            p(f'{target}:', file=sys.stderr, bold=True)
+        for fg, count in counter[target].most_common():
             p(f'There are {count} {fg} lines ({EXPLANATION[fg]})',
               file=sys.stderr, fg=fg)
 
-        if dependency_tree:
-            print_dependency_tree()
+    if loop_lags:
+        p(file=sys.stderr)
+        p(f'Event loop lag: max {max(loop_lags) * 1000:.0f} ms, '
+          f'mean {sum(loop_lags) / len(loop_lags) * 1000:.0f} ms',
+          file=sys.stderr)
+        loop_lags.clear()
+
+    return failed
 
 @click.command()
 @click.argument(
@@ -603,8 +1112,54 @@ async def main(pkgs=None, open_bug_reports=False, with_reason=False, blues_file=
     '--dependency-tree/--no-dependency-tree',
     help='Show dependency tree of blue packages'
 )
-def run(pkgs, open_bug_reports, with_reason=None, blues_file=None, magentas_file=None, dependency_tree=None):
-    asyncio.run(main(pkgs, open_bug_reports, with_reason, blues_file, magentas_file, dependency_tree))
+@click.option(
+    '--lengths-histogram',
+    type=int,
+    metavar='BUCKET_SIZE',
+    help='Instead of checking failures, show a histogram of build.log '
+        + 'lengths of all latest builds (to tune LIMIT)'
+)
+@click.option(
+    '--project',
+    'projects',
+    multiple=True,
+    default=PROJECTS,
+    show_default=True,
+    help='Copr project to check, can be given multiple times'
+)
+@click.option(
+    '--chroot',
+    'chroots',
+    multiple=True,
+    default=CHROOTS,
+    show_default=True,
+    help='Copr chroot to check (in every project), can be given multiple times'
+)
+@click.option(
+    '--watch',
+    type=int,
+    metavar='SECONDS',
+    help='Keep running and poll the monitor every SECONDS, '
+        + 'only checking builds that changed since the last poll '
+        + '(builds that fail to be checked are logged and retried)'
+)
+@click.option(
+    '--clusters/--no-clusters',
+    help='Group red packages by similar errors in their build logs'
+)
+@click.option(
+    '--builds-file',
+    type=click.File('r'),
+    help='Only check the builds from a given file with "package build_id" lines '
+        + '(as written by copr_bulk.py)'
+)
+@click.option(
+    '--by-impact/--no-by-impact',
+    help=f'Sort the output and the bug reports by how many packages from {PKGS} '
+        + 'each package blocks (transitively)'
+)
+def run(pkgs, open_bug_reports, with_reason=None, blues_file=None, magentas_file=None, dependency_tree=None, lengths_histogram=None, projects=PROJECTS, chroots=CHROOTS, watch=None, clusters=False, builds_file=None, by_impact=False):
+    asyncio.run(main(pkgs, open_bug_reports, with_reason, blues_file, magentas_file, dependency_tree, lengths_histogram, projects, chroots, watch, clusters, builds_file, by_impact))
 
 if __name__ == '__main__':
     run()
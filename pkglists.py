@@ -0,0 +1,145 @@
+"""
+Set operations on *.pkgs files (one package name per line, sorted).
+
+The operations are evaluated left to right and streamed:
+each file is read line by line and merged with the others,
+so chaining several operations costs one pass over all the inputs.
+
+    $ python pkglists.py python310.pkgs - closed.pkgs + new.pkgs and copr.pkgs -o todo.pkgs
+
+Streaming needs the inputs sorted bytewise (LC_ALL=C sort -u). The files
+that are not (e.g. sorted case-insensitively) are sorted in memory instead,
+with a warning, --sort does that for all of them.
+"""
+import heapq
+import pathlib
+
+import click
+from click import secho
+
+OPERATORS = {
+    '+': 'union',
+    'or': 'union',
+    '-': 'difference',
+    'minus': 'difference',
+    '&': 'intersection',
+    'and': 'intersection',
+}
+
+
+def names(path):
+    with open(path) as f:
+        for line in f:
+            name = line.strip()
+            if name:
+                yield name
+
+
+def unsorted(path):
+    """The first pair of names out of the bytewise order in the file, or None"""
+    previous = None
+    for name in names(path):
+        if previous is not None and name < previous:
+            return previous, name
+        previous = name
+    return None
+
+
+def read(path, *, sort=False):
+    """Yield unique package names from a file, in bytewise order"""
+    if not sort:
+        pair = unsorted(path)
+        if pair:
+            secho(f'{path} is not sorted bytewise ({" > ".join(pair)}), '
+                  'sorting it in memory', err=True, fg='yellow')
+            sort = True
+    if sort:
+        yield from sorted(set(names(path)))
+        return
+    previous = None
+    for name in names(path):
+        if name != previous:
+            previous = name
+            yield name
+
+
+def union(left, right):
+    previous = None
+    for name in heapq.merge(left, right):
+        if name != previous:
+            yield name
+            previous = name
+
+
+def difference(left, right):
+    right = iter(right)
+    other = next(right, None)
+    for name in left:
+        while other is not None and other < name:
+            other = next(right, None)
+        if name != other:
+            yield name
+
+
+def intersection(left, right):
+    right = iter(right)
+    other = next(right, None)
+    for name in left:
+        while other is not None and other < name:
+            other = next(right, None)
+        if other is None:
+            return
+        if name == other:
+            yield name
+
+
+def evaluate(tokens, *, sort=False):
+    """
+    Chain the operations from the given tokens: file [operator file]...
+    Returns a generator, nothing is read until it is consumed.
+    """
+    first, *rest = tokens
+    result = read(pathlib.Path(first), sort=sort)
+    if len(rest) % 2:
+        raise click.UsageError('Expected: FILE [OPERATOR FILE]...')
+    for operator, path in zip(rest[::2], rest[1::2]):
+        try:
+            operation = globals()[OPERATORS[operator]]
+        except KeyError:
+            raise click.UsageError(
+                f'Unknown operator {operator}, use one of: {" ".join(OPERATORS)}'
+            ) from None
+        result = operation(result, read(pathlib.Path(path), sort=sort))
+    return result
+
+
+@click.command()
+@click.argument('tokens', nargs=-1, required=True, metavar='FILE [OPERATOR FILE]...')
+@click.option(
+    '-o', '--output',
+    type=click.File('w'),
+    default='-',
+    help='Write the resulting list to a given file'
+)
+@click.option(
+    '--count/--no-count',
+    help='Only print the number of resulting packages'
+)
+@click.option(
+    '--sort/--no-sort',
+    help='Sort the inputs in memory, for files not sorted bytewise'
+)
+def run(tokens, output, count, sort):
+    result = evaluate(tokens, sort=sort)
+    try:
+        if count:
+            print(sum(1 for _ in result), file=output)
+        else:
+            for name in result:
+                print(name, file=output)
+    except FileNotFoundError as e:
+        raise click.ClickException(str(e)) from None
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,206 @@
+"""
+The dependencies between the source packages in rawhide, loaded with DNF:
+the graph of BuildRequires (and Requires), its strongly connected components
+(cycles) and how many packages each package blocks.
+
+Shared by monitor_check.py (--by-impact) and rebuild_waves.py.
+"""
+import hashlib
+import json
+import logging
+import re
+from collections import defaultdict
+
+import dnf
+
+DNF_CACHEDIR = '_dnf_cache_dir'
+IMPACT_CACHE = '_impact_graph.json'
+ARCH = 'x86_64'
+# the first operand of a rich dependency: a name (like python3dist(foo)) with an optional version
+RICH_FIRST_OPERAND = re.compile(r'\(+\s*([^\s()]+(?:\([^()]*\))?(?:\s+[<>=]+\s+[^\s()]+)?)')
+
+logger = logging.getLogger('rawhide_deps')
+
+
+# {sources: sack}, see rawhide_sack()
+_sacks = {}
+
+
+def rawhide_sack(*, sources=False):
+    """
+    A DNF sack for rawhide, used for queries, cached.
+    Loaded on first use, with sources=True also with the source packages.
+    If that one is already loaded, it is used for the binary packages as well,
+    filter them with arch__neq='src'.
+    """
+    if not sources and True in _sacks:
+        return _sacks[True]
+    if sources not in _sacks:
+        _sacks[sources] = _rawhide_sack(sources)
+    return _sacks[sources]
+
+
+def _rawhide_sack(sources):
+    base = dnf.Base()
+    conf = base.conf
+    conf.cachedir = DNF_CACHEDIR
+    conf.substitutions['basearch'] = ARCH
+    base.repos.add_new_repo('rawhide', conf,
+        baseurl=['http://kojipkgs.fedoraproject.org/repos/rawhide/latest/$basearch/'],
+        skip_if_unavailable=False,
+        enabled=True)
+    if sources:
+        base.repos.add_new_repo('rawhide-source', conf,
+            baseurl=['http://kojipkgs.fedoraproject.org/repos/rawhide/latest/src/'],
+            skip_if_unavailable=False,
+            enabled=True)
+    base.fill_sack(load_system_repo=False, load_available_repos=True)
+    return base.sack
+
+
+def dependency_graph(pkgs, *, runtime=False):
+    """
+    For each source package from pkgs, the set of other source packages from pkgs
+    it BuildRequires (with runtime=True, also those its binary packages Require).
+    """
+    pkgs = set(pkgs)
+    sack = rawhide_sack(sources=True)
+    binaries = sack.query().filter(arch__neq='src').latest()
+    sources = sack.query().filter(arch='src', name=list(pkgs)).latest()
+
+    by_source = defaultdict(list)
+    for binary in binaries:
+        if binary.source_name in pkgs:
+            by_source[binary.source_name].append(binary)
+
+    providers = {}
+    # rich dependencies resolved by the first operand only and those skipped
+    approximated = set()
+    skipped = set()
+
+    def provided_by(reldep):
+        key = str(reldep)
+        if key not in providers:
+            if key.startswith('('):
+                # rich dependencies cannot be queried for providers,
+                # use their first operand, e.g. foo >= 1 from (foo >= 1 with foo < 2)
+                match = RICH_FIRST_OPERAND.match(key)
+                if match:
+                    approximated.add(key)
+                    reldep = match.group(1)
+                else:
+                    skipped.add(key)
+                    providers[key] = set()
+                    return providers[key]
+            if str(reldep).startswith('/'):
+                found = binaries.filter(file=str(reldep)) or binaries.filter(provides=reldep)
+            else:
+                found = binaries.filter(provides=reldep)
+            providers[key] = {binary.source_name for binary in found} & pkgs
+        return providers[key]
+
+    graph = {}
+    for srpm in sources:
+        requires = list(srpm.requires)
+        if runtime:
+            for binary in by_source[srpm.name]:
+                requires.extend(binary.requires)
+        graph[srpm.name] = set().union(*map(provided_by, requires)) - {srpm.name}
+    if approximated or skipped:
+        logger.warning('Resolved %d rich dependencies by their first operand only, '
+                       'skipped %d that could not be parsed', len(approximated), len(skipped))
+        logger.debug('Skipped rich dependencies: %s', ', '.join(sorted(skipped)))
+    return graph
+
+
+def strongly_connected_components(graph):
+    """
+    Tarjan's algorithm, iterative (the graph is too deep for recursion).
+    Yields sets of nodes, every component after all the components it depends on.
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    next_index = 0
+
+    for start in sorted(graph):
+        if start in index:
+            continue
+        work = [(start, iter(sorted(graph[start])))]
+        index[start] = lowlink[start] = next_index
+        next_index += 1
+        stack.append(start)
+        on_stack.add(start)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = next_index
+                    next_index += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(graph[child]))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == node:
+                            break
+                    yield frozenset(component)
+
+
+def impact_index(pkgs):
+    """
+    {package: how many other packages from pkgs transitively Require/BuildRequire it}
+
+    The dependency graph is cached in IMPACT_CACHE,
+    until any of the packages is updated in rawhide.
+    """
+    pkgs = set(pkgs)
+    sources = rawhide_sack(sources=True).query().filter(arch='src', name=list(pkgs)).latest()
+    key = hashlib.sha256('\n'.join(sorted(str(srpm) for srpm in sources)).encode()).hexdigest()
+    try:
+        with open(IMPACT_CACHE) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        cache = {}
+    if cache.get('key') == key:
+        graph = {package: set(deps) for package, deps in cache['graph'].items()}
+    else:
+        graph = dependency_graph(pkgs, runtime=True)
+        with open(IMPACT_CACHE, 'w') as f:
+            json.dump({'key': key, 'graph': {package: sorted(deps) for package, deps in graph.items()}},
+                      f, indent=4, sort_keys=True)
+
+    reverse = {package: set() for package in graph}
+    for package, deps in graph.items():
+        for dep in deps:
+            reverse.setdefault(dep, set()).add(package)
+
+    # Bitsets of the transitive dependents, components come after all their dependents
+    bit = {package: 1 << number for number, package in enumerate(sorted(reverse))}
+    dependents = {}
+    impact = {}
+    for component in strongly_connected_components(reverse):
+        members = 0
+        for package in component:
+            members |= bit[package]
+        reached = members
+        for package in component:
+            for dependent in reverse[package] - component:
+                reached |= dependents[dependent]
+        for package in component:
+            dependents[package] = reached
+            impact[package] = bin(reached).count('1') - 1
+    return impact
@@ -0,0 +1,127 @@
+"""
+Split a package list into rebuild waves, so packages are not built
+before their BuildRequires were rebuilt (and fail blue).
+
+Packages in the same wave don't BuildRequire each other and can be built
+in parallel. Packages in a BuildRequires cycle are built in the same wave
+and need bootstrapping (they are marked with "cycle").
+
+    $ python rebuild_waves.py python310.pkgs --output-dir waves
+    $ parallel -j 12 copr build-package --nowait @python/python3.10 --name -- $(cat waves/00.pkgs)
+"""
+import pathlib
+
+import click
+
+from rawhide_deps import dependency_graph, strongly_connected_components
+
+# when no duration is known for a package
+DEFAULT_MINUTES = 10
+
+
+def waves(graph, durations):
+    """
+    Collapse the cycles and put every component to the earliest possible wave.
+    Returns the waves (lists of components) and the critical path
+    (the longest chain of components by duration) with its length in minutes.
+    """
+    component_of = {}
+    wave_of = {}
+    # the longest (minutes, chain) ending with the component
+    longest = {}
+    result = []
+
+    for component in strongly_connected_components(graph):
+        for node in component:
+            component_of[node] = component
+        deps = {component_of[dep] for node in component for dep in graph[node]} - {component}
+        wave = max((wave_of[dep] + 1 for dep in deps), default=0)
+        wave_of[component] = wave
+        if wave == len(result):
+            result.append([])
+        result[wave].append(component)
+
+        minutes = sum(durations.get(node, DEFAULT_MINUTES) for node in component)
+        before, chain = max((longest[dep] for dep in deps), default=(0, ()))
+        longest[component] = before + minutes, chain + (component,)
+
+    minutes, chain = max(longest.values(), default=(0, ()))
+    return result, chain, minutes
+
+
+def estimate(waves, durations, jobs):
+    """Minutes to build all the waves one after another with the given parallelism"""
+    total = 0
+    for wave in waves:
+        minutes = [sum(durations.get(node, DEFAULT_MINUTES) for node in component)
+                   for component in wave]
+        total += max(max(minutes), sum(minutes) / jobs)
+    return total
+
+
+def read_durations(path):
+    durations = {}
+    if path:
+        for line in pathlib.Path(path).read_text().splitlines():
+            package, minutes = line.split()
+            durations[package] = float(minutes)
+    return durations
+
+
+def format_component(component):
+    if len(component) == 1:
+        return next(iter(component))
+    return f'{" ".join(sorted(component))} (cycle)'
+
+
+@click.command()
+@click.argument('pkgs', default='python310.pkgs', type=click.Path(exists=True))
+@click.option(
+    '--durations',
+    type=click.Path(exists=True),
+    help='File with "package minutes" lines, to estimate the rebuild time '
+        + f'(packages not listed take {DEFAULT_MINUTES} minutes)'
+)
+@click.option(
+    '--jobs',
+    default=12,
+    show_default=True,
+    help='How many builds run in parallel, for the estimate'
+)
+@click.option(
+    '--output-dir',
+    type=click.Path(file_okay=False),
+    help='Write the waves to NN.pkgs files in the given directory'
+)
+def main(pkgs, durations, jobs, output_dir):
+    pkgs = set(pathlib.Path(pkgs).read_text().split())
+    durations = read_durations(durations)
+
+    graph = dependency_graph(pkgs)
+    # packages not found in rawhide can be built anytime
+    for pkg in pkgs - graph.keys():
+        graph[pkg] = set()
+
+    result, chain, minutes = waves(graph, durations)
+
+    if output_dir:
+        output_dir = pathlib.Path(output_dir)
+        output_dir.mkdir(exist_ok=True)
+
+    for number, wave in enumerate(result):
+        names = sorted(node for component in wave for node in component)
+        print(f'# wave {number} ({len(names)} packages)')
+        for component in sorted(wave, key=sorted):
+            print(format_component(component))
+        print()
+        if output_dir:
+            (output_dir / f'{number:02}.pkgs').write_text('\n'.join(names) + '\n')
+
+    print(f'{len(result)} waves, critical path {minutes / 60:.1f} hours:')
+    print(' -> '.join(format_component(component) for component in chain))
+    print(f'Estimated rebuild time with {jobs} parallel builds: '
+          f'{estimate(result, durations, jobs) / 60:.1f} hours')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,21 @@
 import pathlib
 import rpm
 
+import click
+import dnf
+
 SIGNS = {
     1: '>',
     0: '==',
     -1: '<',
 }
 
+DNF_CACHEDIR = '_dnf_cache_dir'
+REPOS = {
+    'koji': 'https://kojipkgs.fedoraproject.org/repos/rawhide/latest/src/',
+    'copr': 'https://copr-be.cloud.fedoraproject.org/results/@python/python3.10/fedora-rawhide-x86_64/',
+}
+
 
 def split(nevra):
     nev, _, ra = nevra.rpartition('-')
@@ -19,30 +28,104 @@ def split(nevra):
     return n, (e, v, r)
 
 
-def main():
-    python38 = set(pathlib.Path('python38.pkgs').read_text().splitlines())
+def from_files(koji, copr):
+    """
+    Read the repoquery files,
+    returns {name: (e, v, r)} dicts and a function to compare their values
+    """
+    kojirepo = set(pathlib.Path(koji).read_text().splitlines())
+    coprrepo = set(pathlib.Path(copr).read_text().splitlines())
+    return (dict(split(pkg) for pkg in kojirepo),
+            dict(split(pkg) for pkg in coprrepo),
+            rpm.labelCompare)
+
+
+def sack():
+    """A DNF sack with the source packages of REPOS (metadata cached in DNF_CACHEDIR)"""
+    base = dnf.Base()
+    conf = base.conf
+    conf.cachedir = DNF_CACHEDIR
+    for name, baseurl in REPOS.items():
+        base.repos.add_new_repo(name, conf,
+            baseurl=[baseurl],
+            skip_if_unavailable=False,
+            enabled=True)
+    base.fill_sack(load_system_repo=False, load_available_repos=True)
+    return base.sack
+
+
+def evr_cmp(pkg, other):
+    """Compare the packages' EVRs in libsolv, normalized to 1, 0, -1"""
+    result = pkg.evr_cmp(other)
+    return (result > 0) - (result < 0)
+
 
-    kojirepo = set(pathlib.Path('koji.repoquery').read_text().splitlines())
-    py39repo = set(pathlib.Path('python39koji.repoquery').read_text().splitlines())
+def from_sack():
+    """
+    Like from_files(), but load the repositories' metadata directly,
+    the values are the loaded packages, compared by libsolv
+    """
+    dicts = []
+    query = sack().query().filter(arch='src')
+    for name in REPOS:
+        dicts.append({pkg.name: pkg for pkg in query.filter(reponame=name).latest()})
+    return (*dicts, evr_cmp)
 
-    kojidict = dict(split(pkg) for pkg in kojirepo)
-    py39dict = dict(split(pkg) for pkg in py39repo)
 
+def format_evr(evr):
+    if isinstance(evr, tuple):
+        return '-'.join(evr)
+    return evr.evr
+
+
+def outdated(pkgs, kojidict, coprdict, compare):
     todo = set()
 
-    for pkg in sorted(python38):
-        if pkg not in py39dict:
+    for pkg in sorted(pkgs):
+        if pkg not in coprdict or pkg not in kojidict:
             continue
-        sign = SIGNS[rpm.labelCompare(kojidict[pkg], py39dict[pkg])]
-        print(f'{pkg: <30} {"-".join(kojidict[pkg])} {sign} {"-".join(py39dict[pkg])}')
+        sign = SIGNS[compare(kojidict[pkg], coprdict[pkg])]
+        print(f'{pkg: <30} {format_evr(kojidict[pkg])} {sign} {format_evr(coprdict[pkg])}')
 
         if sign == '>':
             todo.add(pkg)
 
+    return todo
+
+
+@click.command()
+@click.option(
+    '--pkgs',
+    help='Only consider packages from this list '
+        + '[default: python38.pkgs, with --from-repos python310.pkgs]'
+)
+@click.option(
+    '--from-repos/--from-repoquery-files',
+    help='Load the source packages from the Koji and Copr repositories '
+        + 'directly instead of from koji.repoquery and python39koji.repoquery'
+)
+@click.option(
+    '--queue',
+    type=click.File('w'),
+    help='Write the outdated packages to a given file, to be rebuilt'
+)
+def main(pkgs, from_repos, queue):
+    pkgs = pkgs or ('python310.pkgs' if from_repos else 'python38.pkgs')
+    pkgs = set(pathlib.Path(pkgs).read_text().splitlines())
+
+    if from_repos:
+        kojidict, coprdict, compare = from_sack()
+    else:
+        kojidict, coprdict, compare = from_files('koji.repoquery', 'python39koji.repoquery')
+
+    todo = outdated(pkgs, kojidict, coprdict, compare)
+
     print()
 
     for pkg in sorted(todo):
         print(pkg)
+        if queue:
+            print(pkg, file=queue)
 
 
 if __name__ == '__main__':